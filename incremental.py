@@ -0,0 +1,74 @@
+import hashlib
+import os
+
+def is_up_to_date(output_file, input_files):
+    """Check whether an output file is newer than all of the files it is built from.
+
+    Args:
+        output_file (str): Path to the output file.
+        input_files (list): Paths to the input files the output is generated from.
+
+    Returns:
+        bool: True if the output file exists and is newer than every input file.
+    """
+    if not os.path.isfile(output_file):
+        return False
+    output_mtime = os.path.getmtime(output_file)
+    return all(output_mtime > os.path.getmtime(input_file) for input_file in input_files)
+
+def temp_path(output_file):
+    """Return a temporary path to write an output file to before moving it into place.
+
+    The temporary file keeps the name of the output file, so tools that infer the output
+    format from the file extension behave the same. It is placed in a hidden '.tmp'
+    directory next to the output so that partial outputs are never picked up as inputs by
+    later steps, and so that it can be moved into place with os.replace() once complete.
+
+    Args:
+        output_file (str): Path to the final output file.
+
+    Returns:
+        str: Path to the temporary file.
+    """
+    tmp_dir = os.path.join(os.path.dirname(output_file), ".tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, os.path.basename(output_file))
+
+def _inputs_digest(input_files, key):
+    """Hash the sorted input paths together with their modification times and the key."""
+    digest = hashlib.sha256(f"{key}\n".encode())
+    for input_file in sorted(input_files):
+        digest.update(f"{input_file}\t{os.stat(input_file).st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+def stamp_matches(output_file, input_files, key=''):
+    """Check whether a multi-input output was built from exactly the given input files.
+
+    A sidecar '<output_file>.stamp' file records a hash of the input paths and their
+    modification times, so adding, removing or changing any input invalidates the output.
+
+    Args:
+        output_file (str): Path to the output file.
+        input_files (list): Paths to the input files the output is generated from.
+        key (str): Any other value the output depends on, such as a parameter, that must
+            also match the one recorded in the stamp (default '').
+
+    Returns:
+        bool: True if the output file exists and its stamp matches the input files.
+    """
+    stamp_file = output_file + ".stamp"
+    if not (os.path.isfile(output_file) and os.path.isfile(stamp_file)):
+        return False
+    with open(stamp_file) as f:
+        return f.read().strip() == _inputs_digest(input_files, key)
+
+def write_stamp(output_file, input_files, key=''):
+    """Record the input files an output was built from in its sidecar '.stamp' file.
+
+    Args:
+        output_file (str): Path to the output file.
+        input_files (list): Paths to the input files the output was generated from.
+        key (str): Any other value the output depends on (default '').
+    """
+    with open(output_file + ".stamp", 'w') as f:
+        f.write(_inputs_digest(input_files, key) + '\n')
@@ -0,0 +1,158 @@
+// Nextflow workflow running the same steps as rna_seq_pipeline.main, with every sample
+// scheduled as separate trimming, alignment and mapping tasks. Run locally or hand the
+// tasks to a cluster scheduler with '-profile slurm' (see nextflow.config).
+//
+// Usage:
+//   nextflow run main.nf --fastq_dir /path/to/fastq/files \
+//       --genome_index /path/to/hisat2_genome_index --gtf_file /path/to/genomic_annotations.gtf
+
+nextflow.enable.dsl = 2
+
+params.fastq_dir = null
+params.genome_index = null
+params.gtf_file = null
+params.outdir = 'results'
+
+process TRIM {
+    tag "${id}"
+    cpus 4
+    memory '4 GB'
+    publishDir "${params.outdir}/FASTQ_output", mode: 'copy'
+
+    input:
+    tuple val(id), path(r1), path(r2)
+
+    output:
+    tuple val(id), path("trimmed.${id}_1.fastq.gz"), path("trimmed.${id}_2.fastq.gz")
+
+    script:
+    """
+    cutadapt -j ${task.cpus} -Z \\
+        -a AGATCGGAAGAGCACACGTCTGAACTCCAGTCA -A AGATCGGAAGAGCGTCGTGTAGGGAAAGAGTGT \\
+        -o trimmed.${id}_1.fastq.gz -p trimmed.${id}_2.fastq.gz ${r1} ${r2}
+    """
+}
+
+process ALIGN {
+    tag "${name}"
+    cpus 8
+    memory '12 GB'
+    publishDir "${params.outdir}/hisat2_output", mode: 'copy'
+
+    input:
+    tuple val(name), path(reads)
+
+    output:
+    tuple val(name), path("sorted.aligned.${name}.bam"), emit: bam
+    path "aligned.${name}.log", emit: log
+
+    script:
+    """
+    set -o pipefail
+    hisat2 -q -p ${task.cpus} --dta-cufflinks --no-unal --no-temp-splicesite \\
+        -x ${params.genome_index} -U ${reads} 2> aligned.${name}.log \\
+        | samtools sort -@ ${task.cpus} -l 1 -o sorted.aligned.${name}.bam - 2>> aligned.${name}.log
+    """
+}
+
+process EXTRACT_DCX {
+    cpus 1
+    memory '2 GB'
+    publishDir "${params.outdir}/mapped_transcripts", mode: 'copy'
+
+    input:
+    path gtf_file
+
+    output:
+    path "Dcx.gtf"
+
+    script:
+    """
+    PYTHONPATH=${projectDir} python3 -c \\
+        "from trim_and_map_transcripts import DCX_GENE_ID, extract_gene_annotations; \\
+         extract_gene_annotations('${gtf_file}', DCX_GENE_ID, 'Dcx.gtf')"
+    """
+}
+
+process STRINGTIE {
+    tag "${name}"
+    cpus 4
+    memory '4 GB'
+    publishDir "${params.outdir}/mapped_transcripts", mode: 'copy'
+
+    input:
+    tuple val(name), path(bam)
+    path reference_gtf
+
+    output:
+    path "covered_transcripts_sorted.aligned.${name}.gtf"
+
+    script:
+    """
+    stringtie -p ${task.cpus} ${bam} -G ${reference_gtf} \\
+        -C covered_transcripts_sorted.aligned.${name}.gtf -l sorted.aligned.${name} \\
+        > /dev/null 2> covered_transcripts_sorted.aligned.${name}.log
+    """
+}
+
+process MERGE {
+    cpus 1
+    memory '4 GB'
+    publishDir "${params.outdir}/mapped_transcripts", mode: 'copy'
+
+    input:
+    path covered_gtfs
+    path reference_gtf
+
+    output:
+    path "ref_merged_transcripts.gtf"
+
+    script:
+    """
+    printf '%s\\n' ${covered_gtfs} > assembly_gtf_list.txt
+    stringtie --merge -G ${reference_gtf} -o ref_merged_transcripts.gtf assembly_gtf_list.txt
+    """
+}
+
+process STRINGTIE_MERGED {
+    tag "${name}"
+    cpus 4
+    memory '4 GB'
+    publishDir "${params.outdir}/mapped_transcripts", mode: 'copy'
+
+    input:
+    tuple val(name), path(bam)
+    path merged_gtf
+
+    output:
+    path "merged_covered_transcripts_sorted.aligned.${name}.gtf"
+
+    script:
+    """
+    stringtie -p ${task.cpus} ${bam} -G ${merged_gtf} \\
+        -C merged_covered_transcripts_sorted.aligned.${name}.gtf -l sorted.aligned.${name} \\
+        > /dev/null 2> merged_covered_transcripts_sorted.aligned.${name}.log
+    """
+}
+
+workflow {
+    if (!params.fastq_dir || !params.genome_index || !params.gtf_file) {
+        error "Please provide --fastq_dir, --genome_index and --gtf_file"
+    }
+
+    // Pick up plain and gzipped reads, as process_fastq_files does
+    read_pairs = Channel
+        .fromFilePairs("${params.fastq_dir}/*_{1,2}.fastq{,.gz}", checkIfExists: true)
+        .map { id, reads -> tuple(id, reads[0], reads[1]) }
+
+    // Each mate is aligned on its own, as in align_with_hisat2
+    trimmed_reads = TRIM(read_pairs)
+        .flatMap { id, r1, r2 -> [tuple("trimmed.${id}_1", r1), tuple("trimmed.${id}_2", r2)] }
+
+    bams = ALIGN(trimmed_reads).bam
+    dcx_gtf = EXTRACT_DCX(file(params.gtf_file, checkIfExists: true))
+
+    covered_gtfs = STRINGTIE(bams, dcx_gtf)
+    merged_gtf = MERGE(covered_gtfs.collect(), dcx_gtf)
+    STRINGTIE_MERGED(bams, merged_gtf)
+}
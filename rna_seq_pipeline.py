@@ -1,18 +1,69 @@
 import os
 import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from incremental import is_up_to_date, temp_path
 from process_fastq_files import process_fastq_files
 from align_with_hisat2 import align_with_hisat2
+from run_sample import run_sample
 from trim_and_map_transcripts import trim_and_map_transcripts
 
-def main(gtf_file, genome_index):
-    """Process FASTQ files, align with Hisat2, map transcripts using Stringtie, and convert SAM to BAM.
+def _run_samples(fastq_dir, genome_index, threads_per_job=4):
+    """Trim and align every paired-end sample in fastq_dir through the run_sample fast path.
 
-    This script automates the processing of FASTQ files, alignment with Hisat2, mapping of transcripts using Stringtie,
-    and conversion of resulting SAM files to BAM format.
+    Samples are run concurrently, as many at once as fit on the available cores given that each sample keeps a
+    cutadapt process and two Hisat2 processes busy throughout, with 'threads_per_job' threads each. The two
+    'samtools sort' processes of a sample are not counted: they mostly buffer the alignments in memory and only use
+    their threads in bursts, when compressing a full buffer to a temporary file and when merging at the end.
+
+    Args:
+        fastq_dir (str): Path to the directory containing the paired-end FASTQ files.
+        genome_index (str): Path to the Hisat2 genome index.
+        threads_per_job (int): Number of threads given to each cutadapt, Hisat2 and samtools process (default 4).
+
+    Returns:
+        str: Path to the output directory where sorted BAM files are saved.
+    """
+    if not os.path.isdir(fastq_dir):
+        raise FileNotFoundError(f"The directory '{fastq_dir}' does not exist.")
+    output_dir = os.path.join(os.path.dirname(fastq_dir), "hisat2_output")
+
+    with os.scandir(fastq_dir) as entries:
+        forward_reads = [entry for entry in entries
+                         if entry.is_file() and entry.name.endswith(('_1.fastq', '_1.fastq.gz'))]
+    if not forward_reads:
+        os.makedirs(output_dir, exist_ok=True)
+        return output_dir
+
+    # cutadapt and both Hisat2 processes of each sample run for the whole sample
+    jobs = max(1, (os.cpu_count() or 1) // (3 * threads_per_job))
+    with ProcessPoolExecutor(max_workers=min(jobs, len(forward_reads))) as executor:
+        futures = []
+        for entry in forward_reads:
+            # The matching reverse reads replace the '_1' before the extension with '_2'
+            suffix = '_1.fastq.gz' if entry.name.endswith('.gz') else '_1.fastq'
+            fastq_2 = f"{entry.path[:-len(suffix)]}_2{suffix[2:]}"
+            futures.append(executor.submit(run_sample, entry.path, fastq_2, genome_index, output_dir, threads_per_job))
+        # Surface any failed sample
+        for future in as_completed(futures):
+            future.result()
+    return output_dir
+
+def main(gtf_file, genome_index, genome_fa=None, fast_path=False):
+    """Process FASTQ files, align with Hisat2 into sorted BAM files, and map transcripts using Stringtie.
+
+    This script automates the processing of FASTQ files, alignment with Hisat2 into sorted BAM files, and mapping
+    of transcripts using Stringtie. Alignments are streamed from Hisat2 into samtools, so no intermediate SAM files
+    are written. If a reference genome FASTA file is given, the sorted BAM files are also converted to reference-based
+    CRAM files, which are typically 30-60% smaller than BAM, for compact storage of the alignments.
 
     Args:
         gtf_file (str): Path to the GTF file containing genomic annotations.
         genome_index (str): Path to the Hisat2 genome index.
+        genome_fa (str, optional): Path to the reference genome FASTA file the index was built from. If given,
+            CRAM copies of the alignments are written to a 'cram' directory next to the BAM files.
+        fast_path (bool): Whether to trim and align each sample with run_sample, which streams the trimmed reads
+            through named pipes into Hisat2 instead of writing them to disk (default False). The trimmed FASTQ
+            files are then not kept.
 
     Raises:
         FileNotFoundError: If any of the input directories or files are not found.
@@ -20,10 +71,12 @@ def main(gtf_file, genome_index):
 
     Note:
         - This script requires the following modules to be accessible: process_fastq, align_with_hisat2, 
-          trim_and_map_transcripts.
+          run_sample, trim_and_map_transcripts, incremental.
         - Ensure that all required modules are either in the same directory as this script or are accessible 
           via Python's module search path.
-        - Paths to FASTQ files directory, genome index, GTF file, and the location for BAM output are currently hardcoded.
+        - Stringtie is still run on the BAM files, as reading CRAM input requires a newer Stringtie release than
+          the one this pipeline is pinned to.
+        - Paths to FASTQ files directory, genome index, GTF file, and the location for output are currently hardcoded.
           Ensure that these paths are updated to reflect the actual locations of the files on your system or provide them
           as arguments to this function for greater flexibility.
     """
@@ -31,22 +84,80 @@ def main(gtf_file, genome_index):
         # Define the directory where the fastq files are stored
         fastq_files_dir = "/path/to/fastq/files"
     
-        # Step 1: Process FASTQ files and store the output directory
-        trimmed_reads_dir = process_fastq_files(fastq_files_dir)
-    
-        # Step 2: Align trimmed reads with Hisat2 and store the output directory
-        aligned_reads_dir = align_with_hisat2(trimmed_reads_dir, genome_index)
-    
-        bam_output_dir = os.path.join(os.path.dirname(aligned_reads_dir), "bam")
-        os.makedirs(bam_output_dir, exist_ok=True)
-        
-        for sam_file in os.listdir(aligned_reads_dir):
-            if sam_file.endswith(".sam"):
-                input_sam = os.path.join(aligned_reads_dir, sam_file)
-                output_bam = os.path.join(bam_output_dir, os.path.splitext(sam_file)[0] + ".bam")
-                subprocess.run(['samtools', 'view', '-bS', input_sam, '-o', output_bam], check=True)
-                
+        if fast_path:
+            # Steps 1 and 2: Trim and align each sample in one pipeline, without intermediate files
+            aligned_reads_dir = _run_samples(fastq_files_dir, genome_index)
+        else:
+            # Step 1: Process FASTQ files and store the output directory
+            trimmed_reads_dir = process_fastq_files(fastq_files_dir)
+
+            # Step 2: Align trimmed reads with Hisat2 into sorted BAM files and store the output directory
+            aligned_reads_dir = align_with_hisat2(trimmed_reads_dir, genome_index)
+
+        # Convert the sorted BAM files to reference-based CRAM files for storage
+        if genome_fa is not None:
+            if not os.path.isfile(genome_fa):
+                raise FileNotFoundError(f"The reference genome file '{genome_fa}' does not exist.")
+
+            cram_output_dir = os.path.join(os.path.dirname(aligned_reads_dir), "cram")
+            os.makedirs(cram_output_dir, exist_ok=True)
+            threads = str(os.cpu_count() or 1)
+
+            with os.scandir(aligned_reads_dir) as entries:
+                bam_files = [entry for entry in entries if entry.is_file() and entry.name.endswith(".bam")]
+            output_cram_path = os.path.join(cram_output_dir, "{}.cram").format
+            for entry in bam_files:
+                output_cram = output_cram_path(entry.name[:-len(".bam")])
+                if is_up_to_date(output_cram, [entry.path, genome_fa]):
+                    continue
+                tmp_cram = temp_path(output_cram)
+                with open(output_cram[:-len(".cram")] + ".log", 'w') as log_file:
+                    subprocess.run(['samtools', 'view', '-@', threads, '-C', '-T', genome_fa, '-o', tmp_cram, entry.path],
+                                   stdout=log_file, stderr=subprocess.STDOUT, check=True)
+                os.replace(tmp_cram, output_cram)
+
         # Step 3: Trim genome to region of interest and map transcripts using Stringtie
-        trim_and_map_transcripts(bam_output_dir, gtf_file)
+        trim_and_map_transcripts(aligned_reads_dir, gtf_file)
     except (FileNotFoundError, OSError) as e:
         raise OSError(f"Error during execution: {e}")
+
+def run_snakemake(fastq_dir, gtf_file, genome_index, cores=None, threads_per_job=4):
+    """Run the pipeline through the Snakemake workflow defined in the 'Snakefile'.
+
+    The Snakemake workflow runs the same commands as main(), but schedules each sample through trimming, alignment
+    and transcript mapping as separate jobs. Different samples can therefore be at different stages at once, and
+    only outputs that are missing or older than their inputs are rebuilt.
+
+    Args:
+        fastq_dir (str): Path to the directory containing the paired-end FASTQ files.
+        gtf_file (str): Path to the GTF file containing genomic annotations.
+        genome_index (str): Path to the Hisat2 genome index.
+        cores (int, optional): Number of cores Snakemake may use. Defaults to os.cpu_count().
+        threads_per_job (int): Number of threads given to each cutadapt, Hisat2, samtools and Stringtie job
+            (default 4).
+
+    Raises:
+        FileNotFoundError: If fastq_dir, gtf_file or genome_index does not exist.
+        OSError: If an error occurs during execution.
+
+    Note:
+        - Snakemake is required to use this function. It can be installed via pip: 'pip install snakemake'.
+    """
+    if not os.path.isdir(fastq_dir):
+        raise FileNotFoundError(f"The directory '{fastq_dir}' does not exist.")
+    if not os.path.isfile(gtf_file):
+        raise FileNotFoundError(f"The file '{gtf_file}' does not exist.")
+    if not os.path.isfile(genome_index):
+        raise FileNotFoundError(f"The genome index file '{genome_index}' does not exist.")
+
+    if cores is None:
+        cores = os.cpu_count() or 1
+    snakefile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Snakefile")
+
+    try:
+        subprocess.run(['snakemake', '--snakefile', snakefile, '-j', str(cores), '--config',
+                        f"fastq_dir={os.path.abspath(fastq_dir)}", f"gtf_file={os.path.abspath(gtf_file)}",
+                        f"genome_index={os.path.abspath(genome_index)}", f"threads_per_job={threads_per_job}"],
+                       check=True)
+    except OSError as e:
+        raise OSError(f"Error during execution: {e}")
@@ -0,0 +1,156 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from align_with_hisat2 import HISAT2_OPTIONS, NO_SPLICESITE_OPTIONS, align_to_sorted_bam
+from incremental import is_up_to_date, temp_path
+from process_fastq_files import ADAPTER_1, ADAPTER_2
+
+def _align_from_fifo(reads, hisat2_command, output_bam, log_path, threads):
+    """Align the reads cutadapt writes to a named pipe, streaming them into a sorted BAM file."""
+    with reads:
+        align_to_sorted_bam(hisat2_command, output_bam, log_path, threads, 1, stdin=reads)
+
+def _release_when_done(cutadapt, guards):
+    """Wait for cutadapt to exit, then close the guard write ends so the aligners reach end-of-file."""
+    try:
+        cutadapt.wait()
+    finally:
+        for guard in guards:
+            os.close(guard)
+
+def run_sample(fastq_1, fastq_2, genome_index, output_dir, threads=4):
+    """Trim, align and sort one paired-end sample without writing any intermediate files.
+
+    This is a single-machine fast path for process_fastq_files followed by align_with_hisat2. Instead of writing
+    the trimmed reads to disk and reading them back, cutadapt writes the trimmed forward and reverse reads to two
+    named pipes. Each pipe is read by its own Hisat2 process, whose alignments are streamed into 'samtools sort':
+
+        cutadapt -o fifo_1 -p fifo_2,  hisat2 -U - < fifo_1 | samtools sort
+                                       hisat2 -U - < fifo_2 | samtools sort
+
+    Only the sorted BAM files are written to disk. As in align_with_hisat2, the forward and reverse reads are
+    aligned separately, so the BAM files are named and laid out exactly as align_with_hisat2 would produce
+    them from the output of process_fastq_files, and trim_and_map_transcripts can be run on them unchanged. The
+    trimmed FASTQ files themselves are not kept.
+
+    Args:
+        fastq_1 (str): Path to the FASTQ file with the forward reads ('<sample>_1.fastq' or '<sample>_1.fastq.gz').
+        fastq_2 (str): Path to the FASTQ file with the reverse reads ('<sample>_2.fastq' or '<sample>_2.fastq.gz').
+        genome_index (str): Path to the Hisat2 genome index.
+        output_dir (str): Path to the directory where the sorted BAM files and logs are saved.
+        threads (int): Number of threads given to cutadapt and to each Hisat2 and samtools process (default 4).
+
+    Raises:
+        FileNotFoundError: If either FASTQ file or genome_index does not exist.
+        OSError: If an error occurs during trimming or alignment.
+
+    Returns:
+        list: Paths to the sorted BAM files of the forward and reverse reads.
+
+    Note:
+        - The same cutadapt, Hisat2 and samtools installations as for process_fastq_files and align_with_hisat2
+          are required. Named pipes are only available on Unix-like systems.
+    """
+    for fastq in (fastq_1, fastq_2):
+        if not os.path.isfile(fastq):
+            raise FileNotFoundError(f"The file '{fastq}' does not exist.")
+    if not os.path.isfile(genome_index):
+        raise FileNotFoundError(f"The genome index file '{genome_index}' does not exist.")
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Name the outputs as align_with_hisat2 names them for the trimmed files of process_fastq_files
+    file_names = []
+    for fastq in (fastq_1, fastq_2):
+        name = os.path.basename(fastq)
+        suffix = '.fastq.gz' if name.endswith('.gz') else '.fastq'
+        file_names.append(f"trimmed.{name[:-len(suffix)]}")
+    output_bams = [os.path.join(output_dir, f"sorted.aligned.{file_name}.bam") for file_name in file_names]
+
+    # Skip samples already aligned since their FASTQ files last changed
+    if all(is_up_to_date(output_bam, [fastq_1, fastq_2]) for output_bam in output_bams):
+        return output_bams
+
+    # The aligners write to temporary BAM files, which are only moved into place once cutadapt and both aligners
+    # have succeeded, so a failed or interrupted run never leaves BAM files from partial reads that look up to date
+    staged_bams = [temp_path(output_bam) for output_bam in output_bams]
+    fifo_dir = tempfile.mkdtemp(prefix="run_sample.")
+    try:
+        fifos = [os.path.join(fifo_dir, f"{file_name}.fastq") for file_name in file_names]
+        for fifo in fifos:
+            os.mkfifo(fifo)
+
+        cutadapt_command = [
+            'cutadapt',
+            '-j', str(threads),
+            '-a', ADAPTER_1,
+            '-A', ADAPTER_2,
+            '-o', fifos[0],
+            '-p', fifos[1],
+            fastq_1,
+            fastq_2
+        ]
+        # Log cutadapt's report under the sample name, without the '_1' mate suffix
+        cutadapt_log = os.path.join(output_dir, f"{file_names[0][:-len('_1')]}.log")
+
+        # Open the read end of each pipe without blocking, then hold a write end open until cutadapt has exited. The
+        # aligners can then neither block waiting for cutadapt to open the pipes, nor see end-of-file before it has.
+        readers = []
+        guards = []
+        for fifo in fifos:
+            read_fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+            os.set_blocking(read_fd, True)
+            readers.append(os.fdopen(read_fd, 'rb'))
+            guards.append(os.open(fifo, os.O_WRONLY))
+
+        with open(cutadapt_log, 'w') as log_file, ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [
+                executor.submit(_align_from_fifo, reads,
+                                ['hisat2', *HISAT2_OPTIONS, *NO_SPLICESITE_OPTIONS, '-p', str(threads),
+                                 '-x', genome_index, '-U', '-'],
+                                staged_bam, os.path.join(output_dir, f"aligned.{file_name}.log"), threads)
+                for reads, staged_bam, file_name in zip(readers, staged_bams, file_names)
+            ]
+            try:
+                cutadapt = subprocess.Popen(cutadapt_command, stdout=log_file, stderr=subprocess.STDOUT)
+            except BaseException:
+                # Without cutadapt nothing else will let the aligners reach end-of-file
+                for guard in guards:
+                    os.close(guard)
+                raise
+            executor.submit(_release_when_done, cutadapt, guards)
+
+            # An aligner that fails closes its pipe, and cutadapt then blocks forever opening or writing to it, so
+            # stop cutadapt as soon as either aligner fails (or this function is interrupted)
+            aligner_failed = True
+            try:
+                done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                aligner_failed = any(future.exception() is not None for future in done)
+            finally:
+                if aligner_failed:
+                    cutadapt.kill()
+        # Leaving the executor has waited for cutadapt and both aligners to finish
+
+        cutadapt_error = None
+        if cutadapt.returncode != 0:
+            cutadapt_error = subprocess.CalledProcessError(cutadapt.returncode, cutadapt_command)
+        # A failed aligner makes cutadapt die of a broken pipe or be stopped, so the aligner's error is the one to
+        # report
+        for future in futures:
+            if future.exception() is not None:
+                raise future.exception() from cutadapt_error
+        if cutadapt_error is not None:
+            raise cutadapt_error
+        for staged_bam, output_bam in zip(staged_bams, output_bams):
+            os.replace(staged_bam, output_bam)
+        return output_bams
+
+    except OSError as e:
+        raise OSError(f"Error during trimming and alignment of '{fastq_1}': {e}")
+    finally:
+        shutil.rmtree(fifo_dir, ignore_errors=True)
+        # Discard the alignments of a failed run, which only saw part of the reads
+        for staged_bam in staged_bams:
+            if os.path.exists(staged_bam):
+                os.remove(staged_bam)
@@ -0,0 +1,14 @@
+import os
+import sys
+import types
+
+# Make the pipeline modules importable from the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# process_fastq_files imports the cutadapt package although the pipeline only runs its command-line tool, which the
+# tests replace with a stub, so the package does not need to be installed to run them
+if 'cutadapt' not in sys.modules:
+    try:
+        import cutadapt  # noqa: F401
+    except ImportError:
+        sys.modules['cutadapt'] = types.ModuleType('cutadapt')
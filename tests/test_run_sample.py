@@ -0,0 +1,108 @@
+import os
+import subprocess
+import sys
+import threading
+import pytest
+from run_sample import run_sample
+
+# Stub tools standing in for cutadapt, Hisat2 and samtools. cutadapt writes a few reads to each of its outputs, Hisat2
+# copies its input to its output and samtools writes its input to the '-o' file. Environment variables make them
+# fail or start slowly.
+CUTADAPT = """
+import os, sys, time
+time.sleep(float(os.environ.get('STUB_CUTADAPT_DELAY', '0')))
+if os.environ.get('STUB_CUTADAPT_FAIL'):
+    sys.exit(1)
+output_1 = sys.argv[sys.argv.index('-o') + 1]
+output_2 = sys.argv[sys.argv.index('-p') + 1]
+with open(output_1, 'w') as f1, open(output_2, 'w') as f2:
+    for i in range(int(os.environ.get('STUB_READS', '10'))):
+        f1.write(f'@read{i}/1\\nACGT\\n+\\nIIII\\n')
+        f2.write(f'@read{i}/2\\nTGCA\\n+\\nIIII\\n')
+"""
+HISAT2 = """
+import os, sys
+if os.environ.get('STUB_HISAT2_FAIL'):
+    sys.exit(1)
+sys.stdout.write(sys.stdin.read())
+"""
+SAMTOOLS = """
+import sys
+data = sys.stdin.read()
+with open(sys.argv[sys.argv.index('-o') + 1], 'w') as f:
+    f.write(data)
+"""
+
+def _write_stub(bin_dir, name, source):
+    path = os.path.join(bin_dir, name)
+    with open(path, 'w') as f:
+        f.write(f"#!{sys.executable}\n{source}")
+    os.chmod(path, 0o755)
+
+@pytest.fixture
+def sample(tmp_path, monkeypatch):
+    """Create the inputs of one sample and make the stub tools the only ones on PATH."""
+    for name in ("sample_1.fastq", "sample_2.fastq", "genome.idx"):
+        (tmp_path / name).touch()
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, source in (('cutadapt', CUTADAPT), ('hisat2', HISAT2), ('samtools', SAMTOOLS)):
+        _write_stub(bin_dir, name, source)
+    monkeypatch.setenv('PATH', str(bin_dir))
+    return tmp_path
+
+def _run(sample):
+    return run_sample(str(sample / "sample_1.fastq"), str(sample / "sample_2.fastq"), str(sample / "genome.idx"),
+                      str(sample / "out"))
+
+def _bams(sample):
+    return sorted(name for name in os.listdir(sample / "out") if name.endswith(".bam"))
+
+def test_run_sample_writes_sorted_bams(sample):
+    output_bams = _run(sample)
+
+    assert _bams(sample) == ["sorted.aligned.trimmed.sample_1.bam", "sorted.aligned.trimmed.sample_2.bam"]
+    with open(output_bams[0]) as f:
+        assert f.read().count('@read') == 10
+    with open(output_bams[1]) as f:
+        assert '@read9/2' in f.read()
+
+def test_failed_cutadapt_leaves_no_bams(sample, monkeypatch):
+    monkeypatch.setenv('STUB_CUTADAPT_FAIL', '1')
+
+    with pytest.raises(subprocess.CalledProcessError):
+        _run(sample)
+    assert _bams(sample) == []
+
+def test_missing_cutadapt_leaves_no_bams(sample):
+    os.remove(sample / "bin" / "cutadapt")
+
+    with pytest.raises(OSError):
+        _run(sample)
+    assert _bams(sample) == []
+
+    # The failed run must not have left anything that makes a rerun skip the sample
+    _write_stub(sample / "bin", 'cutadapt', CUTADAPT)
+    output_bams = _run(sample)
+    with open(output_bams[0]) as f:
+        assert f.read().count('@read') == 10
+
+def test_early_hisat2_failure_raises(sample, monkeypatch):
+    # Hisat2 exits before cutadapt has opened its output pipes, as it does with a wrong genome index
+    monkeypatch.setenv('STUB_HISAT2_FAIL', '1')
+    monkeypatch.setenv('STUB_CUTADAPT_DELAY', '1')
+
+    errors = []
+    def target():
+        try:
+            _run(sample)
+        except Exception as e:
+            errors.append(e)
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+
+    assert not thread.is_alive(), "run_sample did not return after Hisat2 failed"
+    assert isinstance(errors[0], subprocess.CalledProcessError)
+    assert errors[0].cmd[0] == 'hisat2'
+    assert _bams(sample) == []
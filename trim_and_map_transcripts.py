@@ -1,16 +1,91 @@
+import mmap
 import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from incremental import is_up_to_date, stamp_matches, temp_path, write_stamp
 
-def trim_and_map_transcripts(input_dir, gtf_file):
+# Ensembl gene ID of the mouse Dcx gene
+DCX_GENE_ID = "ENSMUSG00000031285"
+
+def extract_gene_annotations(gtf_file, gene_id, output_gtf):
+    """Write the GTF records of a single gene to a separate GTF file.
+
+    The GTF file is scanned through a read-only memory map and every line whose attributes
+    contain the gene ID is copied to the output. The extracted file is reused on later runs
+    only if it was extracted for the same gene ID from the same GTF file path, unmodified
+    since, as recorded in its '.stamp' file.
+
+    Args:
+        gtf_file (str): Path to the GTF file containing genomic annotations.
+        gene_id (str): Gene ID to extract, as given in the 'gene_id' attribute.
+        output_gtf (str): Path to the GTF file to write.
+    """
+    if stamp_matches(output_gtf, [gtf_file], key=gene_id):
+        return
+
+    pattern = f'gene_id "{gene_id}'.encode()
+    # Write to a temporary file so an interrupted run never leaves a partial cache behind
+    tmp_gtf = temp_path(output_gtf)
+    with open(gtf_file, 'rb') as f, open(tmp_gtf, 'wb') as out:
+        # mmap cannot map an empty file
+        if os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as gtf:
+                for line in iter(gtf.readline, b''):
+                    if pattern in line:
+                        out.write(line)
+    os.replace(tmp_gtf, output_gtf)
+    write_stamp(output_gtf, [gtf_file], key=gene_id)
+
+def _run_to_file(command, tmp_output, output_file, log_path):
+    """Run a command writing to 'tmp_output' and move the result to 'output_file' once it succeeds.
+
+    Diagnostics go to 'log_path'. Standard output is discarded, as Stringtie prints the full
+    assembly there when no '-o' output file is given.
+    """
+    with open(log_path, 'w') as log_file:
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=log_file, check=True)
+    os.replace(tmp_output, output_file)
+
+def _run_concurrently(tasks, jobs):
+    """Run each command in its own subprocess, at most 'jobs' at a time.
+
+    Threads are sufficient here since each worker only waits on its subprocess.
+
+    Args:
+        tasks (list): (command, tmp_output, output_file, log_path) tuples, where each command
+            writes to 'tmp_output', which is moved to 'output_file' when the command succeeds,
+            and its messages to 'log_path'.
+        jobs (int): Maximum number of commands running at once.
+
+    Raises:
+        subprocess.CalledProcessError: If any of the commands exits with an error.
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_run_to_file, *task) for task in tasks]
+        # Surface any failed command
+        for future in as_completed(futures):
+            future.result()
+
+def trim_and_map_transcripts(input_dir, gtf_file, threads_per_job=4, jobs=None):
     """Trim genome to region of interest using gene name of Dcx and map transcripts using Stringtie.
 
     This function trims the genome to the region of interest specified by the Dcx gene name in the provided GTF file.
     It then maps transcripts from alignment to the Dcx region of the genome using Stringtie, capturing transcripts 
-    that cover this region. Finally, it merges the transcripts obtained from the alignment into a single GTF file.
+    that cover this region. It then merges the transcripts obtained from the alignment into a single GTF file, and
+    finally maps the sorted BAM files (named 'sorted.*.bam') against the merged transcripts, writing
+    'merged_covered_transcripts_<sample>.gtf' files.
+
+    The BAM files are processed concurrently, one Stringtie process per sample, since each sample is independent
+    and Stringtie gains little from running with more than a few threads. Outputs that are newer than their inputs
+    are kept from a previous run instead of being regenerated. The messages of each Stringtie process are written to
+    a per-sample log file in the output directory.
 
     Args:
         input_dir (str): Path to the directory containing sorted BAM files.
         gtf_file (str): Path to the GTF file containing the region of interest (Dcx gene).
+        threads_per_job (int): Number of threads given to each Stringtie process (default 4).
+        jobs (int, optional): Number of samples processed concurrently. Defaults to
+            os.cpu_count() // threads_per_job (at least 1).
 
     Raises:
         FileNotFoundError: If input_dir or gtf_file does not exist.
@@ -21,7 +96,7 @@ def trim_and_map_transcripts(input_dir, gtf_file):
 
     Note:
         - This function is specifically tailored for the DCX gene. To adapt it for other genes:
-            1. Replace the gene name 'ENSMUSG00000031285' with the appropriate gene name in the 'awk' command.
+            1. Replace the gene ID 'ENSMUSG00000031285' in 'DCX_GENE_ID' with the appropriate gene ID.
             2. Modify the 'dcx_gtf' variable to specify the output GTF file name accordingly.
             3. Ensure that the gene name specified in step 1 matches the gene name in the 'G' option of Stringtie commands.
             4. Adjust any other parameters or file names as necessary for your specific gene of interest.
@@ -44,41 +119,73 @@ def trim_and_map_transcripts(input_dir, gtf_file):
     output_dir = os.path.join(os.path.dirname(input_dir), "mapped_transcripts")
     os.makedirs(output_dir, exist_ok=True)
 
+    # Use as many concurrent jobs as fit on the machine unless told otherwise
+    if jobs is None:
+        jobs = max(1, (os.cpu_count() or 1) // threads_per_job)
+
     try:
         # Step 1: Trim genome to region of interest using gene name of Dcx
         dcx_gtf = os.path.join(output_dir, "Dcx.gtf")
-        with open(dcx_gtf, 'w') as dcx_gtf_file:
-            subprocess.run(['awk', '$8 == "ENSMUSG00000031285"', gtf_file], stdout=dcx_gtf_file, check=True)
+        extract_gene_annotations(gtf_file, DCX_GENE_ID, dcx_gtf)
 
-        # Step 2: Map transcripts from alignment to Dcx region of Genome using Stringtie
-        for bam_file in os.listdir(input_dir):
-            if bam_file.endswith(".bam"):
-                input_bam = os.path.join(input_dir, bam_file)
-                output_prefix = os.path.splitext(bam_file)[0]
-
-                covered_transcripts_gtf = os.path.join(output_dir, f"covered_transcripts_{output_prefix}.gtf")
-                subprocess.run(['stringtie', input_bam, '-G', dcx_gtf, '-C', covered_transcripts_gtf, '-l', output_prefix],
-                               check=True)
-
-        # Step 3: Merge transcripts
-        assembly_gtf_list = os.path.join(output_dir, "assembly_gtf_list.txt")
-        with open(assembly_gtf_list, 'w') as f:
-            for gtf_file in os.listdir(output_dir):
-                if gtf_file.startswith("covered_transcripts_") and gtf_file.endswith(".gtf"):
-                    f.write(os.path.join(output_dir, gtf_file) + '\n')
+        # List the BAM files once and partition them for both mapping steps
+        with os.scandir(input_dir) as entries:
+            bam_files = [(entry.name, entry.path) for entry in entries
+                         if entry.is_file() and entry.name.endswith(".bam")]
+        sorted_bam_files = [bam for bam in bam_files if bam[0].startswith("sorted.")]
 
+        # Build output paths by formatting a single template rather than joining paths per file
+        covered_transcripts_path = os.path.join(output_dir, "covered_transcripts_{}.gtf").format
+        log_path = os.path.join(output_dir, "covered_transcripts_{}.log").format
+        # Step 4 maps the same sorted BAM files, so it needs its own output names
+        merged_covered_transcripts_path = os.path.join(output_dir, "merged_covered_transcripts_{}.gtf").format
+        merged_log_path = os.path.join(output_dir, "merged_covered_transcripts_{}.log").format
+
+        # Step 2: Map transcripts from alignment to Dcx region of Genome using Stringtie
+        stringtie_tasks = []
+        covered_gtfs = []
+        for bam_file, input_bam in bam_files:
+            output_prefix = bam_file[:-len(".bam")]
+
+            covered_transcripts_gtf = covered_transcripts_path(output_prefix)
+            covered_gtfs.append(covered_transcripts_gtf)
+            # Skip samples whose covered transcripts are newer than their alignment and reference
+            if is_up_to_date(covered_transcripts_gtf, [input_bam, dcx_gtf]):
+                continue
+            tmp_gtf = temp_path(covered_transcripts_gtf)
+            stringtie_tasks.append((['stringtie', '-p', str(threads_per_job), input_bam, '-G', dcx_gtf,
+                                     '-C', tmp_gtf, '-l', output_prefix], tmp_gtf, covered_transcripts_gtf,
+                                    log_path(output_prefix)))
+        # All samples must be mapped before their transcripts are merged
+        _run_concurrently(stringtie_tasks, jobs)
+
+        # Step 3: Merge the transcripts mapped in Step 2
         merged_transcripts_gtf = os.path.join(output_dir, "ref_merged_transcripts.gtf")
-        subprocess.run(['stringtie', '--merge', '-G', dcx_gtf, '-o', merged_transcripts_gtf, assembly_gtf_list], check=True)
+        # Only merge again if the set of transcripts or the reference has changed since the last merge
+        merge_inputs = covered_gtfs + [dcx_gtf]
+        if not stamp_matches(merged_transcripts_gtf, merge_inputs):
+            assembly_gtf_list = os.path.join(output_dir, "assembly_gtf_list.txt")
+            with open(assembly_gtf_list, 'w') as f:
+                f.write(''.join(covered_gtf + '\n' for covered_gtf in covered_gtfs))
+
+            tmp_merged_gtf = temp_path(merged_transcripts_gtf)
+            subprocess.run(['stringtie', '--merge', '-G', dcx_gtf, '-o', tmp_merged_gtf, assembly_gtf_list], check=True)
+            os.replace(tmp_merged_gtf, merged_transcripts_gtf)
+            write_stamp(merged_transcripts_gtf, merge_inputs)
 
         # Step 4: Map transcripts from alignment to merged transcripts
-        for bam_file in os.listdir(input_dir):
-            if bam_file.startswith("sorted.") and bam_file.endswith(".bam"):
-                input_bam = os.path.join(input_dir, bam_file)
-                output_prefix = os.path.splitext(bam_file)[0]
-
-                covered_transcripts_gtf = os.path.join(output_dir, f"covered_transcripts_{output_prefix}.gtf")
-                subprocess.run(['stringtie', input_bam, '-G', merged_transcripts_gtf, '-C', covered_transcripts_gtf, '-l', output_prefix],
-                               check=True)
+        stringtie_tasks = []
+        for bam_file, input_bam in sorted_bam_files:
+            output_prefix = bam_file[:-len(".bam")]
+
+            covered_transcripts_gtf = merged_covered_transcripts_path(output_prefix)
+            if is_up_to_date(covered_transcripts_gtf, [input_bam, merged_transcripts_gtf]):
+                continue
+            tmp_gtf = temp_path(covered_transcripts_gtf)
+            stringtie_tasks.append((['stringtie', '-p', str(threads_per_job), input_bam, '-G', merged_transcripts_gtf,
+                                     '-C', tmp_gtf, '-l', output_prefix], tmp_gtf, covered_transcripts_gtf,
+                                    merged_log_path(output_prefix)))
+        _run_concurrently(stringtie_tasks, jobs)
         return output_dir  # Return the path to the output directory
 
     except OSError as e: